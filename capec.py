@@ -1,14 +1,77 @@
-import json
+import functools
 import os
 import re
-from typing import Any
-from query_postgre import run_query
+import string
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple
+import orjson
+from parallel import chunked, map_bounded
+from query_postgre import run_copy_json
 
 TEMPLATE_PATH = "templates/IFT_CAPEC.jsonl"
 OUTPUT_DIR = "filled_templates"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Precompiled split patterns used by the format_* helpers
+_SPLIT_SEMI = re.compile(r"[;,]\s*")
+_SPLIT_NL_SEMI = re.compile(r"[\n;,]\s*")
+_WS = re.compile(r"\s+")
 
+_TAXONOMY_FIELDS = ("entry_name", "entry_id", "taxonomy_name")
+
+
+def _norm(s: Any) -> str:
+    """Collapse runs of whitespace (including newlines) into single spaces."""
+    return _WS.sub(" ", str(s)).strip() if s else ""
+
+
+def _memoize_json(func: Callable[[Any], str], maxsize: int = 4096) -> Callable[[Any], str]:
+    """
+    Cache a formatter's output keyed on the JSON encoding of its argument.
+    CAPEC rows often repeat the same mappings/steps, and lists/dicts are not hashable.
+    """
+    cache: Dict[bytes, str] = {}
+
+    @functools.wraps(func)
+    def wrapper(value: Any) -> str:
+        try:
+            key = orjson.dumps(value)
+        except TypeError:
+            return func(value)
+        result = cache.get(key)
+        if result is None:
+            if len(cache) >= maxsize:
+                cache.clear()
+            result = cache[key] = func(value)
+        return result
+
+    return wrapper
+
+
+def _coerce_list(value: Any, split_re: Optional[Pattern[str]] = _SPLIT_NL_SEMI) -> list:
+    """
+    Return `value` as a list: lists pass through, JSON-array strings are decoded and
+    other strings are split with `split_re` (or kept whole when it is None).
+    """
+    if not value:
+        return []
+    if isinstance(value, list):
+        return value
+    if isinstance(value, str):
+        try:
+            parsed = orjson.loads(value)
+            if isinstance(parsed, list):
+                return parsed
+        except orjson.JSONDecodeError:
+            pass
+        if split_re is None:
+            return [value.strip()]
+        return [v.strip() for v in split_re.split(value) if v.strip()]
+    if isinstance(value, tuple):
+        return list(value)
+    return [value]
+
+
+@_memoize_json
 def format_execution_flow(flow: Any) -> str:
     """
     Convert execution flow into multi-line, bulleted step form for readability.
@@ -19,82 +82,67 @@ def format_execution_flow(flow: Any) -> str:
     # If flow is a JSON string, try to parse it to a list
     if isinstance(flow, str):
         try:
-            parsed = json.loads(flow)
+            parsed = orjson.loads(flow)
             if isinstance(parsed, list):
                 flow = parsed
         except Exception:
             # return stripped string (single-line) as fallback
             return flow.strip()
 
-    blocks = []
+    # Collect every fragment in one list and join once at the end
+    parts: List[str] = []
     for step_obj in (flow or []):
         step_no = step_obj.get("step") or step_obj.get("ste p") or ""
         phase = step_obj.get("phase") or ""
         techniques = step_obj.get("techniques") or []
-        desc = (step_obj.get("description") or "").strip()
+        desc = _norm(step_obj.get("description"))
 
         # Normalize techniques into a list
         if isinstance(techniques, str):
             # attempt to split comma/semicolon separated strings
-            techs = [t.strip() for t in re.split(r"[;,]\s*", techniques) if t.strip()]
+            techs = [t.strip() for t in _SPLIT_SEMI.split(techniques) if t.strip()]
         elif isinstance(techniques, list):
             techs = [str(t).strip() for t in techniques if t is not None and str(t).strip()]
         else:
             techs = [str(techniques).strip()] if techniques else []
 
-        # Build step header
-        header = f"Step {step_no}: During the {phase} phase, the attacker uses:"
-        # Build bullets for techniques/resources used
+        # Steps are separated by a newline
+        if parts:
+            parts.append("\n")
+
+        # Step header
+        parts.extend(("Step ", str(step_no), ": During the ", str(phase), " phase, the attacker uses:\n"))
+        # Bullets for techniques/resources used
         if techs:
-            tech_lines = "\n".join(f"- {t}" for t in techs)
+            for t in techs:
+                parts.extend(("- ", t, "\n"))
         else:
-            tech_lines = "- (no specific techniques listed)"
+            parts.append("- (no specific techniques listed)\n")
 
         # Description line (single paragraph)
-        desc_line = f"Description: {desc}" if desc else "Description: None."
+        parts.extend(("Description: ", desc) if desc else ("Description: None.",))
 
-        # Combine with a blank line at end of step block
-        block = f"{header}\n{tech_lines}\n{desc_line}"
-        blocks.append(block)
+    return "".join(parts)
 
-    # Join steps with a blank line between them
-    return "\n".join(blocks)
 
-def format_prerequisites(prereqs) -> str:
+def format_prerequisites(prereqs: Any) -> str:
     """Return prerequisites as one bullet per line."""
-    if not prereqs:
-        return "- None"
-    # if prereqs is a JSON string, try to parse
-    if isinstance(prereqs, str):
-        try:
-            parsed = json.loads(prereqs)
-            if isinstance(parsed, list):
-                prereqs = parsed
-        except Exception:
-            # fallback: split by newline or semicolon or comma
-            prereqs = [p.strip() for p in re.split(r"[\n;,]\s*", prereqs) if p.strip()]
-    return "\n".join(f"- {p}" for p in prereqs)
+    items = _coerce_list(prereqs)
+    return "\n".join(f"- {p}" for p in items) or "- None"
 
 
-def format_skills(skills) -> str:
+def format_skills(skills: Any) -> str:
     """Return skills as one bullet per line with level and description."""
-    if not skills:
+    # a non-JSON string is treated as a single-line description
+    items = _coerce_list(skills, split_re=None)
+    if not items:
         return "- None"
-    # accept list of dicts or JSON string
-    if isinstance(skills, str):
-        try:
-            parsed = json.loads(skills)
-            if isinstance(parsed, list):
-                skills = parsed
-        except Exception:
-            # fallback: treat as single-line description
-            return f"- {skills.strip()}"
     lines = []
-    for s in skills:
+    for s in items:
         # s might be a dict or a string
         if isinstance(s, dict):
-            level = s.get("level", "").strip()
-            desc = s.get("description", "").strip()
+            level = (s.get("level") or "").strip()
+            desc = (s.get("description") or "").strip()
             if level and desc:
                 lines.append(f"- {level}: {desc}")
             elif desc:
@@ -106,28 +154,20 @@ def format_skills(skills) -> str:
     return "\n".join(lines)
 
 
-def format_resources(resources) -> str:
+def format_resources(resources: Any) -> str:
     """Return resources as bullets."""
-    if not resources:
-        return "- None"
-    if isinstance(resources, str):
-        try:
-            parsed = json.loads(resources)
-            if isinstance(parsed, list):
-                resources = parsed
-        except Exception:
-            resources = [r.strip() for r in re.split(r"[\n;,]\s*", resources) if r.strip()]
-    return "\n".join(f"- {r}" for r in resources)
+    items = _coerce_list(resources)
+    return "\n".join(f"- {r}" for r in items) or "- None"
 
 
-def format_consequences(cons) -> str:
+def format_consequences(cons: Any) -> str:
     if not cons:
         return "None"
 
     lines = []
     for c in cons:
-        impact = c.get("impact", "").strip()
-        scopes = c.get("scopes", [])
+        impact = (c.get("impact") or "").strip()
+        scopes = c.get("scopes") or []
         if scopes:
             scope_str = ", ".join(scopes)
             lines.append(f"- {impact} impacts {scope_str}.")
@@ -137,25 +177,26 @@ def format_consequences(cons) -> str:
     return "\n".join(lines)
 
 
-def format_mitigations(mitigations) -> str:
+def format_mitigations(mitigations: Any) -> str:
     if not mitigations:
         return "No mitigations found"
-    return "\n".join(f"{m}" for m in mitigations)
+    return "\n".join(map(str, mitigations))
 
 
-def format_examples(examples) -> str:
+def format_examples(examples: Any) -> str:
     if not examples:
         return "No examples available"
     return "\n".join(f"- {e}" for e in examples)
 
 
-def format_related_weaknesses(weaknesses) -> str:
+def format_related_weaknesses(weaknesses: Any) -> str:
     if not weaknesses:
         return "No related weaknesses found"
     return ", ".join(weaknesses)
 
 
-def format_taxonomy_mappings(mappings) -> str:
+@_memoize_json
+def format_taxonomy_mappings(mappings: Any) -> str:
     """
     Format taxonomy_mappings into a single readable sentence.
     Accepts list of dicts or JSON string.
@@ -168,17 +209,17 @@ def format_taxonomy_mappings(mappings) -> str:
     # parse JSON string if needed
     if isinstance(mappings, str):
         try:
-            mappings = json.loads(mappings)
+            mappings = orjson.loads(mappings)
         except Exception:
             return mappings.strip()
 
-    formatted = []
-    for m in mappings:
-        entry_id = m.get("entry_id", "").strip()
-        entry_name = m.get("entry_name", "").strip()
-        taxonomy_name = m.get("taxonomy_name", "").strip()
-        if entry_name or entry_id or taxonomy_name:
-            formatted.append(f'"{entry_name}" (ID: {entry_id}, Taxonomy: {taxonomy_name})')
+    # normalize every mapping once, then format the non-empty ones
+    normalized = [[_norm(m.get(k)) for k in _TAXONOMY_FIELDS] for m in mappings]
+    formatted = [
+        f'"{entry_name}" (ID: {entry_id}, Taxonomy: {taxonomy_name})'
+        for entry_name, entry_id, taxonomy_name in normalized
+        if entry_name or entry_id or taxonomy_name
+    ]
 
     if not formatted:
         return "None"
@@ -190,82 +231,153 @@ def format_taxonomy_mappings(mappings) -> str:
         return f'the taxonomy entries {", ".join(formatted[:-1])}, and {formatted[-1]}'
 
 
+def compile_template(text: str) -> Callable[[Dict[str, Any]], str]:
+    """
+    Parse a template string once and return a renderer that fills it from a context dict.
+    Avoids re-tokenizing the format string for every row.
+    """
+    parsed = list(string.Formatter().parse(text))
+    if any(spec or conv for _, field, spec, conv in parsed if field is not None):
+        # conversions / format specs need the full formatter
+        return text.format_map
+
+    pieces = [(literal, field) for literal, field, _, _ in parsed]
+
+    def render(ctx: Dict[str, Any]) -> str:
+        return "".join(lit + (str(ctx[fn]) if fn else "") for lit, fn in pieces)
+
+    return render
+
+
+def compile_input_template(text: str) -> Callable[[Dict[str, Any]], str]:
+    """
+    Specialize an input template of the form "...{name}...{capec_id}..." into plain
+    string concatenation; any other shape falls back to compile_template.
+    """
+    segments = [""]
+    fields = []
+    for literal, field, spec, conv in string.Formatter().parse(text):
+        segments[-1] += literal
+        if field is not None:
+            if spec or conv:
+                return compile_template(text)
+            fields.append(field)
+            segments.append("")
+    if fields != ["name", "capec_id"]:
+        return compile_template(text)
+
+    pre, mid, post = segments
+
+    def render(ctx: Dict[str, Any]) -> str:
+        return pre + ctx["name"] + mid + ctx["capec_id"] + post
+
+    return render
+
+
+# Templates compiled for the current process (set by _init_worker)
+_COMPILED: List[Tuple[str, Callable[[Dict[str, Any]], str], Callable[[Dict[str, Any]], str]]] = []
+
+
+def _init_worker(templates: List[Dict[str, str]]) -> None:
+    """Compile the templates once per worker process (renderers are not picklable)."""
+    global _COMPILED
+    _COMPILED = [
+        (t["instruction"], compile_input_template(t["input"]), compile_template(t["output"]))
+        for t in templates
+    ]
+
+
+def _process_row_chunk(rows: List[Dict[str, Any]]) -> Tuple[bytes, int]:
+    """
+    Fill every template for a chunk of CAPEC rows.
+    Returns the serialized JSONL lines and the number of entries they contain.
+    """
+    lines: List[bytes] = []
+    for row in rows:
+        # Format fields
+        execution_flow_text = format_execution_flow(row["execution_flow"])
+        prerequisites_text = format_prerequisites(row["prerequisites"])
+        skills_text = format_skills(row["skills_required"])
+        resources_text = format_resources(row["resources_required"])
+        consequences_text = format_consequences(row["consequences"])
+        mitigations_text = format_mitigations(row["mitigations"])
+        examples_text = format_examples(row["example_instances"])
+        weaknesses_text = format_related_weaknesses(row["related_weaknesses"])
+        taxonomy_text = format_taxonomy_mappings(row["taxonomy_mappings"])
+
+        ctx = {
+            "name": row["name"] or "",
+            "capec_id": row["capec_id"] or "",
+            "description": row["description"] or "",
+            "abstraction": row["abstraction"] or "",
+            "status": row["status"] or "",
+            "typical_severity": row["typical_severity"] or "",
+            "likelihood_of_attack": row["likelihood_of_attack"] or "",
+            "execution_flow": execution_flow_text,
+            "prerequisites": prerequisites_text,
+            "skills_required": skills_text,
+            "resources_required": resources_text,
+            "consequence": consequences_text,
+            "mitigations": mitigations_text,
+            "example_instances": examples_text,
+            "related_weaknesses": weaknesses_text,
+            "taxonomy_mappings": taxonomy_text,
+        }
+
+        for instruction, render_input, render_output in _COMPILED:
+            entry = {
+                "instruction": instruction,
+                "input": render_input(ctx),
+                "output": render_output(ctx)
+            }
+            lines.append(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE))
+
+    return b"".join(lines), len(lines)
+
+
 def get_output_path(limit: int) -> str:
     return os.path.join(OUTPUT_DIR, f"filled_capec_templates_{limit}.jsonl")
 
 
-def fill_capec_templates(limit: int = 5):
+def fill_capec_templates(limit: int = 5, workers: Optional[int] = None, chunk_size: int = 64) -> None:
     # Load templates
     with open(TEMPLATE_PATH, "r") as f:
-        templates = [json.loads(line) for line in f]
+        templates = [orjson.loads(line) for line in f]
 
     # Fetch CAPEC data from PostgreSQL
-    query = f"""
+    query = """
         SELECT capec_id, name, description, abstraction, status,
                typical_severity, likelihood_of_attack,
                execution_flow, prerequisites, skills_required,
                resources_required, consequences, mitigations,
                example_instances, related_weaknesses, taxonomy_mappings
         FROM capec_patterns
-        LIMIT {limit};
+        LIMIT %s;
     """
-    capec_rows = run_query(query)
-    filled_data = []
-
-    for row in capec_rows:
-        (
-            capec_id, name, description, abstraction, status,
-            typical_severity, likelihood_of_attack,
-            execution_flow, prerequisites, skills_required,
-            resources_required, consequences, mitigations,
-            example_instances, related_weaknesses, taxonomy_mappings
-        ) = row
+    chunks = chunked(run_copy_json(query, (limit,)), chunk_size)
 
-        # Format fields
-        execution_flow_text = format_execution_flow(execution_flow)
-        prerequisites_text = format_prerequisites(prerequisites)
-        skills_text = format_skills(skills_required)
-        resources_text = format_resources(resources_required)
-        consequences_text = format_consequences(consequences)
-        mitigations_text = format_mitigations(mitigations)
-        examples_text = format_examples(example_instances)
-        weaknesses_text = format_related_weaknesses(related_weaknesses)
-        taxonomy_text = format_taxonomy_mappings(taxonomy_mappings)
-
-        for template in templates:
-            output = template["output"].format(
-                name=name or "",
-                capec_id=capec_id or "",
-                description=description or "",
-                abstraction=abstraction or "",
-                status=status or "",
-                typical_severity=typical_severity or "",
-                likelihood_of_attack=likelihood_of_attack or "",
-                execution_flow=execution_flow_text,
-                prerequisites=prerequisites_text,
-                skills_required=skills_text,
-                resources_required=resources_text,
-                consequence=consequences_text,
-                mitigations=mitigations_text,
-                example_instances=examples_text,
-                related_weaknesses=weaknesses_text,
-                taxonomy_mappings=taxonomy_text
-            )
-
-            filled_data.append({
-                "instruction": template["instruction"],
-                "input": template["input"].format(name=name, capec_id=capec_id),
-                "output": output
-            })
-
-    # Write output
+    # Write each chunk as soon as it is produced instead of buffering the whole run
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
     output_path = get_output_path(limit)
-    with open(output_path, "w") as out:
-        for entry in filled_data:
-            json.dump(entry, out, ensure_ascii=False)
-            out.write("\n")
+    filled_count = 0
+    workers = workers or os.cpu_count() or 1
+
+    with open(output_path, "wb", buffering=1 << 20) as out:
+        if workers == 1:
+            _init_worker(templates)
+            for chunk in chunks:
+                data, count = _process_row_chunk(chunk)
+                out.write(data)
+                filled_count += count
+        else:
+            # Rows are independent: fan chunks out to worker processes, keeping a
+            # bounded number in flight and writing results back in input order.
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(templates,)) as executor:
+                for data, count in map_bounded(executor, _process_row_chunk, chunks, 2 * workers):
+                    out.write(data)
+                    filled_count += count
 
-    print(f"✅ Filled {len(filled_data)} CAPEC templates saved to {output_path}")
+    print(f"✅ Filled {filled_count} CAPEC templates saved to {output_path}")
 
 
 if __name__ == "__main__":
@@ -273,5 +385,6 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Fill CAPEC templates")
     parser.add_argument("--limit", type=int, default=5, help="Number of CAPEC rows to process")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count, 1 disables the pool)")
     args = parser.parse_args()
-    fill_capec_templates(limit=args.limit)
+    fill_capec_templates(limit=args.limit, workers=args.workers)
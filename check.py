@@ -1,27 +1,35 @@
 import json
 from pathlib import Path
+from typing import Any, Dict, List
 
 path = Path("filled_templates/filled_cve_templates_400.jsonl")
 
-empty_attack_vectors = []
+MARKERS = (b"CVSS", b"/AV:")
+
+missing = 0
+examples: List[Dict[str, Any]] = []
 total = 0
 
-with path.open("r", encoding="utf-8") as fh:
+with path.open("rb") as fh:
     for line in fh:
         if not line.strip():
             continue
         total += 1
-        entry = json.loads(line)
-        inp = entry.get("input", "")
-        out = entry.get("output", "")
-        # check if vector string like "CVSS:" or "/AV:" appears
-        if "CVSS" not in inp and "CVSS" not in out and "/AV:" not in inp and "/AV:" not in out:
-            empty_attack_vectors.append(entry)
+        # check if vector string like "CVSS:" or "/AV:" appears; lines without either
+        # marker are missing a vector, so they never need to be decoded
+        if any(m in line for m in MARKERS):
+            entry = json.loads(line)
+            text = f"{entry.get('input', '')}\n{entry.get('output', '')}".encode("utf-8")
+            if any(m in text for m in MARKERS):
+                continue
+        missing += 1
+        if len(examples) < 3:
+            examples.append(json.loads(line))
 
 print(f"Total entries checked: {total}")
-print(f"Entries missing CVSS v3.1 vector: {len(empty_attack_vectors)}")
+print(f"Entries missing CVSS v3.1 vector: {missing}")
 
-if empty_attack_vectors:
+if examples:
     print("\nExamples of missing attack vectors:")
-    for e in empty_attack_vectors[:3]:
+    for e in examples:
         print(json.dumps(e, indent=2)[:400], "\n---")
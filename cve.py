@@ -1,44 +1,71 @@
-import json
+import os
 import argparse
+import functools
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 
-from query_postgre import run_query as pg_run_query
+import orjson
+
+from parallel import chunked, map_bounded
+from query_postgre import run_copy_json
+from templating import SafeDict
 
 # Paths
 TEMPLATES_PATH = Path("templates/IFT_CVE.jsonl")
 OUTPUT_DIR = Path("filled_templates")
 
+# CVE rows handed to a worker process at a time
+CHUNK_SIZE = 64
+
+# Output is buffered and written once it grows past this many bytes
+FLUSH_BYTES = 1 << 20
+
+# Drops \r and \t and turns newlines into spaces in a single pass
+_CLEAN_TABLE = str.maketrans({"\r": "", "\t": "", "\n": " "})
+_WS = re.compile(r"\s+")
+_PLACEHOLDER = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
+
 # Helper Functions
 def load_templates(path: Path) -> List[Dict[str, Any]]:
-    """Read JSONL templates file and return list of template dicts."""
+    """
+    Read JSONL templates file and return list of template dicts.
+    Template texts are filled with str.format_map, so literal braces must be written as {{ }}.
+    Each template is annotated with the placeholder names its input (`_in_keys`)
+    and output (`_out_keys`) use, scanned once here instead of per CVE.
+    """
     templates = []
     with path.open("r", encoding="utf-8") as fh:
         for line in fh:
             if line.strip():
-                templates.append(json.loads(line))
+                tmpl = orjson.loads(line)
+                tmpl["_in_keys"] = frozenset(_PLACEHOLDER.findall(tmpl.get("input", "")))
+                tmpl["_out_keys"] = frozenset(_PLACEHOLDER.findall(tmpl.get("output", "")))
+                templates.append(tmpl)
     return templates
 
-def fill_template_text(template_text: str, placeholders: Dict[str, str]) -> str:
-    """Replace {placeholders} in template_text with actual values."""
-    out = template_text
-    for k, v in placeholders.items():
-        out = out.replace(f"{{{k}}}", v if v is not None else "")
-    return out
-
 # Data Extraction
-def get_cve_data(limit: int = None) -> List[Dict[str, Any]]:
+def get_cve_data(limit: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Stream CVE rows with CVSS v3.1 metrics from PostgreSQL.
+    Rows are exported with COPY ... TO STDOUT (one JSON object per row) rather
+    than fetched through the row-by-row cursor protocol.
+    """
     q = """
     SELECT cve_id, descriptions, impacts, metrics
     FROM cve_vulnerabilities
-    WHERE cve_id LIKE 'CVE-2025-%'
+    WHERE cve_id LIKE %s
     ORDER BY cve_id
     """
+    params: Tuple[Any, ...] = ("CVE-2025-%",)
     if limit:
-        q += f" LIMIT {limit * 3}"  # fetch extra to filter later
-    rows = pg_run_query(q, return_dict=True)
+        q += " LIMIT %s"
+        params += (limit * 3,)  # fetch extra to filter later
+    rows = run_copy_json(q, params)
 
-    filtered = []
+    kept = 0
     for r in rows:
         metrics = r.get("metrics")
         if not metrics:
@@ -50,55 +77,65 @@ def get_cve_data(limit: int = None) -> List[Dict[str, Any]]:
         if any(v in metrics_str for v in ("cvssV4", "cvssV3_0")):
             continue
 
-        # Include only CVEs containing CVSSv3.1
-        if "cvssV3_1" in metrics_str:
-            filtered.append(r)
-            continue
-
-        # (Optional fallback) Some feeds may use cvssMetricV31 key (NVD)
-        if "cvssMetricV31" in metrics_str:
-            filtered.append(r)
-            continue
+        # Include only CVEs containing CVSSv3.1, or
+        # (Optional fallback) the cvssMetricV31 key some feeds use (NVD)
+        if "cvssV3_1" in metrics_str or "cvssMetricV31" in metrics_str:
+            yield r
+            kept += 1
+            if limit and kept >= limit:
+                return
+
+
+def _decode_twice(raw: Any) -> Any:
+    """orjson.loads, decoding once more when the value was JSON wrapped in a JSON string."""
+    data = orjson.loads(raw)
+    if isinstance(data, str) and data.lstrip()[:1] in ("[", "{"):
+        data = orjson.loads(data)
+    return data
+
+def _safe_json_load(s: Any) -> Any:
+    """Parse JSON text, repairing common PostgreSQL formatting quirks; None on failure."""
+    # Fast path: well-formed (possibly double-encoded) JSON parses directly;
+    # orjson takes str and bytes alike, so nothing is converted first
+    try:
+        return _decode_twice(s)
+    except (orjson.JSONDecodeError, TypeError):
+        pass
+
+    # Clean newlines, tabs, stray spaces (but avoid aggressive quote replacement);
+    # literal newlines inside the string may split tokens, so they become spaces
+    if isinstance(s, (bytes, bytearray, memoryview)):
+        text = bytes(s).decode("utf-8", "replace")
+    else:
+        text = s if isinstance(s, str) else str(s)
+    cleaned = text.translate(_CLEAN_TABLE).strip()
+    try:
+        return _decode_twice(cleaned)
+    except orjson.JSONDecodeError:
+        pass
 
-    return filtered[:limit] if limit else filtered
+    # Second attempt: try replacing single quotes with double quotes (best-effort)
+    try:
+        return _decode_twice(cleaned.replace("'", '"'))
+    except orjson.JSONDecodeError:
+        # Give up quietly (caller will handle None)
+        return None
 
+# Raw JSON text repeats across rows, so string input is parsed once and cached
+_safe_json_load_str = functools.lru_cache(maxsize=4096)(_safe_json_load)
 
-def safe_json_load(s):
+def safe_json_load(s: Any) -> Any:
     """Try loading JSON safely, handling common PostgreSQL formatting quirks."""
     if not s:
         return None
     if isinstance(s, (dict, list)):
         return s
+    # Cached results are shared between rows; callers only read them
+    if isinstance(s, (str, bytes)):
+        return _safe_json_load_str(s)
+    return _safe_json_load(s)
 
-    try:
-        # Clean newlines, tabs, stray spaces (but avoid aggressive quote replacement)
-        cleaned = (
-            str(s)
-            .replace("\r", "")
-            .replace("\t", "")
-            .strip()
-        )
-        # Remove literal newlines inside string (they may split tokens)
-        cleaned = cleaned.replace("\n", " ")
-        # Attempt first parse
-        data = json.loads(cleaned)
-        # If the result is a stringified JSON (double encoded), parse again
-        if isinstance(data, str) and data.strip().startswith("["):
-            data = json.loads(data)
-        return data
-    except Exception as e:
-        # Second attempt: try replacing single quotes with double quotes (best-effort)
-        try:
-            repaired = cleaned.replace("'", '"')
-            data = json.loads(repaired)
-            if isinstance(data, str) and data.strip().startswith("["):
-                data = json.loads(data)
-            return data
-        except Exception:
-            # Give up quietly (caller will handle None)
-            return None
-
-def extract_cvss_metrics(metrics_json: str) -> Dict[str, str]:
+def extract_cvss_metrics(metrics_json: Any) -> Dict[str, str]:
     """
     Extract CVSSv3.1 baseScore and vectorString from metrics JSON.
     Supports several common layouts:
@@ -158,82 +195,97 @@ def extract_cvss_metrics(metrics_json: str) -> Dict[str, str]:
     # Not found
     return {"cvss_score": "", "attack_vector": ""}
 
-def extract_description(desc_raw: str) -> str:
+def extract_description(desc_raw: Any) -> str:
     """Extract English-language description text from JSON or raw text."""
+    if not desc_raw:
+        return ""
     desc_json = safe_json_load(desc_raw)
-    description = ""
 
     if isinstance(desc_json, list):
-        for d in desc_json:
-            if isinstance(d, dict):
-                # common patterns: {"lang":"en","value":"..."} or {"value":"...","lang":"en"}
-                if d.get("lang") == "en" and d.get("value"):
-                    description = d.get("value")
-                    break
-                # sometimes the object itself is the text
-                if d.get("value") and not d.get("lang"):
-                    description = d.get("value")
-                    break
+        # first {"lang":"en","value":"..."} entry, or one whose value has no language tag
+        description = next(
+            (
+                d["value"] for d in desc_json
+                if isinstance(d, dict) and d.get("value") and (d.get("lang") == "en" or not d.get("lang"))
+            ),
+            "",
+        )
     elif isinstance(desc_json, dict):
-        # support nested keys
-        if "value" in desc_json:
-            description = desc_json.get("value", "")
-        else:
-            # fallback stringify
-            description = json.dumps(desc_json)
+        # a single description object; anything else is not description text
+        description = desc_json.get("value") or ""
     else:
         description = str(desc_raw)
 
     # Normalize whitespace / newlines into single spaces
-    return " ".join(description.split())
+    return _WS.sub(" ", description).strip()
 
 # Core Logic
-def build_filled_entries(templates: List[Dict[str, Any]], cves: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    filled = []
+def build_filled_entries(templates: List[Dict[str, Any]], cves: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Yield one filled entry per (CVE, template) pair as CVE rows arrive."""
+    # Fields no template references are never extracted
+    used_keys = frozenset().union(*(t["_in_keys"] | t["_out_keys"] for t in templates))
+    need_description = "cve_description" in used_keys
+    need_cvss = "cvss_score" in used_keys or "attack_vector" in used_keys
+
+    # Bind each template's text and fill methods once, not per (CVE, template) pair
+    prepared = [
+        (tmpl.get("instruction", ""), tmpl.get("input", "").format_map, tmpl.get("output", "").format_map)
+        for tmpl in templates
+    ]
 
     for cve in cves:
-        cve_id = cve.get("cve_id", "")
-        desc_raw = cve.get("descriptions", "")
-        imp_raw = cve.get("impacts", "")
-        metrics_raw = cve.get("metrics", "")
-
-        description = extract_description(desc_raw)
-        cvss_data = extract_cvss_metrics(metrics_raw)
-        cvss_score = cvss_data.get("cvss_score", "")
-        attack_vector = cvss_data.get("attack_vector", "")
-
-        placeholders_base = {
-            "cve_id": cve_id,
-            "cve_description": description,
-            "cvss_score": cvss_score,
-            "attack_vector": attack_vector,
-        }
-
-        for tmpl in templates:
-            instr = tmpl.get("instruction", "")
-            inp = tmpl.get("input", "")
-            out = tmpl.get("output", "")
-
-            # detect which placeholders are used (input OR output)
-            placeholders = {
-                k: v for k, v in placeholders_base.items()
-                if f"{{{k}}}" in inp or f"{{{k}}}" in out
+        placeholders_base = SafeDict(cve_id=cve.get("cve_id", ""))
+        if need_description:
+            placeholders_base["cve_description"] = extract_description(cve.get("descriptions", ""))
+        if need_cvss:
+            cvss_data = extract_cvss_metrics(cve.get("metrics", ""))
+            placeholders_base["cvss_score"] = cvss_data.get("cvss_score", "")
+            placeholders_base["attack_vector"] = cvss_data.get("attack_vector", "")
+
+        for instruction, fill_input, fill_output in prepared:
+            yield {
+                "instruction": instruction,
+                "input": fill_input(placeholders_base),
+                "output": fill_output(placeholders_base),
             }
 
-            filled.append({
-                "instruction": instr,
-                "input": fill_template_text(inp, placeholders),
-                "output": fill_template_text(out, placeholders),
-            })
+# Parallel Filling
+# Templates for the current process (set by _init_worker)
+_TEMPLATES: List[Dict[str, Any]] = []
+
+def _init_worker(templates: List[Dict[str, Any]]) -> None:
+    """Hand the (read-only) templates to a worker process once."""
+    global _TEMPLATES
+    _TEMPLATES = templates
 
-    return filled
+def _process_cve_chunk(cves: List[Dict[str, Any]]) -> Tuple[bytes, int]:
+    """Fill every template for a chunk of CVE rows; return the JSONL bytes and entry count."""
+    lines = [
+        orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE)
+        for entry in build_filled_entries(_TEMPLATES, cves)
+    ]
+    return b"".join(lines), len(lines)
+
+def fill_chunks(templates: List[Dict[str, Any]], chunks: Iterable[List[Dict[str, Any]]], workers: int) -> Iterator[Tuple[bytes, int]]:
+    """
+    Fill CVE chunks, in worker processes when workers > 1, yielding results in input order.
+    At most 2 x workers chunks are in flight so the row stream is never fully buffered.
+    """
+    if workers <= 1:
+        _init_worker(templates)
+        yield from map(_process_cve_chunk, chunks)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(templates,)) as executor:
+        yield from map_bounded(executor, _process_cve_chunk, chunks, 2 * workers)
 
 # Main
-def main():
+def main() -> None:
     parser = argparse.ArgumentParser(description="Fill CVE templates using PostgreSQL.")
     parser.add_argument("--limit", type=int, default=None, help="Limit number of CVEs")
     parser.add_argument("--templates", type=str, default=str(TEMPLATES_PATH))
     parser.add_argument("--outdir", type=str, default=str(OUTPUT_DIR))
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count, 1 disables the pool)")
     args = parser.parse_args()
 
     outdir = Path(args.outdir)
@@ -241,18 +293,29 @@ def main():
 
     templates = load_templates(Path(args.templates))
     cves = get_cve_data(limit=args.limit)
-    if not cves:
+    first = next(cves, None)
+    if first is None:
         print("No CVEs found.")
         return
 
-    filled_entries = build_filled_entries(templates, cves)
-    print(f"Built {len(filled_entries)} filled CVE template entries.")
+    # Chunks are written as they are filled. The COPY export is spooled first (in memory up
+    # to run_copy_json's spool_size, then on disk), so only the rows in flight are decoded
+    chunks = chunked(chain([first], cves), CHUNK_SIZE)
+    workers = args.workers or os.cpu_count() or 1
+    filled_count = 0
 
     outpath = outdir / f"filled_cve_templates_{args.limit or 'all'}.jsonl"
-    with outpath.open("w", encoding="utf-8") as fh:
-        for entry in filled_entries:
-            fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
-
+    with outpath.open("wb") as fh:
+        buf = bytearray()
+        for data, count in fill_chunks(templates, chunks, workers):
+            buf += data
+            filled_count += count
+            if len(buf) > FLUSH_BYTES:
+                fh.write(buf)
+                buf.clear()
+        fh.write(buf)
+
+    print(f"Built {filled_count} filled CVE template entries.")
     print(f"Saved filled templates to: {outpath.resolve()}")
 
 if __name__ == "__main__":
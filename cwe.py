@@ -1,40 +1,73 @@
-import json
+import functools
 import os
 import re
-from typing import Any
+from typing import Any, Callable, Dict, List
+import orjson
 from query_postgre import run_query
 from query_neo4j import run_query_dict
+from templating import SafeDict
 
 TEMPLATE_PATH = "templates/IFT_CWE.jsonl"
 OUTPUT_DIR = "filled_templates"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Output is buffered and written once it grows past this many bytes
+FLUSH_BYTES = 1 << 20
 
-def get_capec_attack_patterns(cwe_id: str) -> str:
+_SPLIT_LIST = re.compile(r'[\n;]+')
+
+
+def _cache_str_arg(func: Callable[[Any], str]) -> Callable[[Any], str]:
     """
-    Fetch CAPEC attack pattern names and IDs related to a CWE from Neo4j.
-    Returns a nicely formatted string, or a fallback message if none found.
+    Memoize a formatter for raw string input (JSON text straight from the DB).
+    The same blobs repeat across CWEs; already-parsed lists/dicts fall through uncached.
+    """
+    cached = functools.lru_cache(maxsize=4096)(func)
+
+    @functools.wraps(func)
+    def wrapper(value: Any) -> str:
+        if isinstance(value, str):
+            return cached(value)
+        return func(value)
+
+    return wrapper
+
+
+def get_capec_attack_patterns(cwe_ids: List[str]) -> Dict[str, str]:
     """
-    query = f"""
-    MATCH (c:CAPEC)-[:EXPLOITS]->(w:CWE {{cwe_id: '{cwe_id}'}})
-    RETURN c.capec_id AS id, c.name AS name
+    Fetch CAPEC attack pattern names and IDs related to each CWE from Neo4j in one query.
+    Returns a dict of CWE ID -> nicely formatted string; CWEs without any related
+    pattern are absent, so callers fall back to "None found".
     """
-    results = run_query_dict(query, keys=["id", "name"])
-    if not results:
-        return "None found"
-    
-    formatted_patterns = [f"{r['name']} ({r['id']})" for r in results if r.get("name") and r.get("id")]
-    return ", ".join(formatted_patterns) if formatted_patterns else "no related attack patterns found"
+    if not cwe_ids:
+        return {}
 
+    query = """
+    UNWIND $ids AS cwe_id
+    MATCH (c:CAPEC)-[:EXPLOITS]->(w:CWE {cwe_id: cwe_id})
+    RETURN cwe_id, c.capec_id AS id, c.name AS name
+    """
+    results = run_query_dict(query, keys=["cwe_id", "id", "name"], params={"ids": cwe_ids})
+
+    grouped: Dict[str, List[str]] = {}
+    for r in results:
+        patterns = grouped.setdefault(r["cwe_id"], [])
+        if r.get("name") and r.get("id"):
+            patterns.append(f"{r['name']} ({r['id']})")
+
+    return {
+        cwe_id: ", ".join(patterns) if patterns else "no related attack patterns found"
+        for cwe_id, patterns in grouped.items()
+    }
 
-def format_background_details(details) -> str:
+
+def format_background_details(details: Any) -> str:
     if not details:
         return ""
     if isinstance(details, list):
         return " ".join(d.strip() for d in details)  # no numbering
     if isinstance(details, str):
         try:
-            parsed = json.loads(details)
+            parsed = orjson.loads(details)
             if isinstance(parsed, list):
                 return " ".join(d.strip() for d in parsed)
             return str(parsed)
@@ -43,54 +76,49 @@ def format_background_details(details) -> str:
     return str(details)
 
 
-def format_detection_methods(methods) -> str:
+def format_detection_methods(methods: List[Dict[str, str]]) -> str:
     if not methods:
         return "no detection methods available"
-    sentences = []
-    for i, m in enumerate(methods, start=1):
-        desc = m.get("description", "").strip()
-        name = m.get("method", "").strip()
-        sentences.append(f"{i}. {name}: {desc}")
-    return "\n".join(sentences)
+    return "\n".join(
+        f"{i}. {m.get('method', '').strip()}: {m.get('description', '').strip()}"
+        for i, m in enumerate(methods, start=1)
+    )
 
 
-def format_mitigations(mitigations) -> str:
+def format_mitigations(mitigations: List[Dict[str, str]]) -> str:
     if not mitigations:
         return "No specific mitigations are listed for this weakness."
-    sentences = []
-    for i, m in enumerate(mitigations, start=1):
+
+    def _fmt(i: int, m: Dict[str, str]) -> str:
         phase = m.get("phase", "").strip()
         desc = m.get("description", "").strip()
+        return f"{i}. {phase}: {desc}" if phase else f"{i}. {desc}"
 
-        if phase:
-            sentences.append(f"{i}. {phase}: {desc}")
-        else:
-            sentences.append(f"{i}. {desc}")
-
-    return "\n".join(sentences)
+    return "\n".join(_fmt(i, m) for i, m in enumerate(mitigations, start=1))
 
-def _ensure_list(x: Any):
+def _ensure_list(x: Any) -> List[Any]:
     if x is None:
         return []
     if isinstance(x, str):
         try:
-            parsed = json.loads(x)
+            parsed = orjson.loads(x)
             if isinstance(parsed, list):
                 return parsed
         except Exception:
             # not JSON list — try split by newlines/semicolons, else return single string
-            parts = [p.strip() for p in re.split(r'[\n;]+', x) if p.strip()]
+            parts = [p.strip() for p in _SPLIT_LIST.split(x) if p.strip()]
             return parts if parts else [x.strip()]
     if isinstance(x, (list, tuple)):
         return list(x)
     return [x]
 
+@_cache_str_arg
 def format_modes(modes: Any) -> str:
     modes_list = _ensure_list(modes)
     if not modes_list:
         return "unknown"
 
-    clauses = []
+    clauses: List[str] = []
     for m in modes_list:
         if isinstance(m, str):
             phase = m.strip()
@@ -128,7 +156,7 @@ def format_modes(modes: Any) -> str:
     return f"{joined}"
 
 
-def format_related_weaknesses(weaknesses) -> str:
+def format_related_weaknesses(weaknesses: List[Dict[str, Any]]) -> str:
     if not weaknesses:
         return "none"
     sentences = []
@@ -140,119 +168,124 @@ def format_related_weaknesses(weaknesses) -> str:
     return ", ".join(sentences)
 
 
-def format_observed_examples(examples) -> str:
+def format_observed_examples(examples: List[Dict[str, str]]) -> str:
     if not examples:
         return "no examples available"
-    sentences = []
-    for i, e in enumerate(examples, start=1):
-        ref = e.get("reference", "")
-        desc = e.get("description", "").strip()
-        sentences.append(f"{i}. {ref}: {desc}")
-    return "\n".join(sentences)
+    return "\n".join(
+        f"{i}. {e.get('reference', '')}: {e.get('description', '').strip()}"
+        for i, e in enumerate(examples, start=1)
+    )
 
-def format_common_consequences(consequences) -> str:
+@_cache_str_arg
+def format_common_consequences(consequences: Any) -> str:
     if not consequences:
         return "No known consequences have been reported."
 
     # Parse JSON if necessary
     if isinstance(consequences, str):
         try:
-            consequences = json.loads(consequences)
+            consequences = orjson.loads(consequences)
         except Exception:
             return consequences.strip()
 
-    lines = []
-    for i, item in enumerate(consequences, start=1):
-        if isinstance(item, dict):
-            note = item.get("note", "").strip()
-            impact = item.get("impact", "").strip()
-            scopes = ", ".join(item.get("scopes", []))
-
-            # Build natural-language sentence
-            sentence = f"{i}. {note}"
-            if impact and scopes:
-                sentence += f" This primarily impacts {scopes.lower()} through {impact.lower()}."
-            elif impact:
-                sentence += f" This results in {impact.lower()}."
-            elif scopes:
-                sentence += f" This affects {scopes.lower()}."
-        else:
-            sentence = f"{i}. {item}"
-        lines.append(sentence)
+    def _fmt(i: int, item: Any) -> str:
+        if not isinstance(item, dict):
+            return f"{i}. {item}"
+
+        note = (item.get("note") or "").strip()
+        # lower-cased once; they are only ever used mid-sentence
+        impact = (item.get("impact") or "").strip().lower()
+        scopes = ", ".join(item.get("scopes") or []).lower()
 
-    return "\n".join(lines)
+        # Build natural-language sentence
+        if impact and scopes:
+            return f"{i}. {note} This primarily impacts {scopes} through {impact}."
+        if impact:
+            return f"{i}. {note} This results in {impact}."
+        if scopes:
+            return f"{i}. {note} This affects {scopes}."
+        return f"{i}. {note}"
+
+    return "\n".join(_fmt(i, item) for i, item in enumerate(consequences, start=1))
 
 
 def get_output_path(limit: int) -> str:
     return os.path.join(OUTPUT_DIR, f"filled_cwe_templates_{limit}.jsonl")
 
 
-def fill_templates(limit: int = 5):
+def fill_templates(limit: int = 5) -> None:
     # Load templates
     with open(TEMPLATE_PATH, "r") as f:
-        templates = [json.loads(line) for line in f]
+        templates = [orjson.loads(line) for line in f]
 
     # Fetch CWE data
-    query = f"""
+    query = """
         SELECT cwe_id, name, description, extended_description,
                background_details, common_consequences,
                detection_methods, potential_mitigations,
                modes_of_introduction, related_weaknesses, observed_examples
         FROM cwe_weaknesses
-        LIMIT {limit};
+        LIMIT %s;
     """
-    cwe_rows = run_query(query)
-
-    filled_data = []
-
-    for row in cwe_rows:
-        (
-            cwe_id, name, description, extended_description,
-            background_details, common_consequences,
-            detection_methods, potential_mitigations,
-            modes_of_introduction, related_weaknesses, observed_examples
-        ) = row
-
-        # Format fields properly
-        detection_methods_text = format_detection_methods(detection_methods)
-        mitigations_text = format_mitigations(potential_mitigations)
-        modes_text = format_modes(modes_of_introduction)
-        weaknesses_text = format_related_weaknesses(related_weaknesses)
-        examples_text = format_observed_examples(observed_examples)
-        attack_patterns_text = get_capec_attack_patterns(cwe_id)
-        background_details_text = format_background_details(background_details)
-        common_consequences_text = format_common_consequences(common_consequences)
-
-        for template in templates:
-            output = template["output"].format(
-                name=name or "",
-                cwe_id=cwe_id or "",
-                description=description or "",
-                extended_description=extended_description or "",
-                detection_methods=detection_methods_text,
-                background_details=background_details_text,
-                potential_mitigations=mitigations_text,
-                common_consequences=common_consequences_text,
-                modes_of_introduction=modes_text,
-                related_weaknesses=weaknesses_text,
-                related_attack_patterns=attack_patterns_text,
-                observed_examples=examples_text
-            )
-
-            filled_data.append({
-                "instruction": template["instruction"],
-                "input": template["input"].format(name=name, cwe_id=cwe_id),
-                "output": output
-            })
+    cwe_rows = run_query(query, params=(limit,))
+    # One Neo4j round-trip for every CWE instead of one per row
+    attack_patterns_by_cwe = get_capec_attack_patterns([row[0] for row in cwe_rows])
 
-    # Write output
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
     output_path = get_output_path(limit)
-    with open(output_path, "w") as out:
-        for entry in filled_data:
-            json.dump(entry, out, ensure_ascii=False)
-            out.write("\n")
+    with open(output_path, "wb") as out:
+        buf = bytearray()
+        filled_count = 0
+
+        for row in cwe_rows:
+            (
+                cwe_id, name, description, extended_description,
+                background_details, common_consequences,
+                detection_methods, potential_mitigations,
+                modes_of_introduction, related_weaknesses, observed_examples
+            ) = row
+
+            # Format fields properly
+            detection_methods_text = format_detection_methods(detection_methods)
+            mitigations_text = format_mitigations(potential_mitigations)
+            modes_text = format_modes(modes_of_introduction)
+            weaknesses_text = format_related_weaknesses(related_weaknesses)
+            examples_text = format_observed_examples(observed_examples)
+            attack_patterns_text = attack_patterns_by_cwe.get(cwe_id, "None found")
+            background_details_text = format_background_details(background_details)
+            common_consequences_text = format_common_consequences(common_consequences)
+
+            # Build the substitution context once per row and reuse it for every template
+            ctx = SafeDict({
+                "name": name or "",
+                "cwe_id": cwe_id or "",
+                "description": description or "",
+                "extended_description": extended_description or "",
+                "detection_methods": detection_methods_text,
+                "background_details": background_details_text,
+                "potential_mitigations": mitigations_text,
+                "common_consequences": common_consequences_text,
+                "modes_of_introduction": modes_text,
+                "related_weaknesses": weaknesses_text,
+                "related_attack_patterns": attack_patterns_text,
+                "observed_examples": examples_text,
+            })
+
+            for template in templates:
+                buf += orjson.dumps({
+                    "instruction": template["instruction"],
+                    "input": template["input"].format_map(ctx),
+                    "output": template["output"].format_map(ctx)
+                }, option=orjson.OPT_APPEND_NEWLINE)
+                filled_count += 1
+
+            if len(buf) > FLUSH_BYTES:
+                out.write(buf)
+                buf.clear()
+
+        out.write(buf)
 
-    print(f"✅ Filled {len(filled_data)} templates saved to {output_path}")
+    print(f"✅ Filled {filled_count} templates saved to {output_path}")
 
 
 if __name__ == "__main__":
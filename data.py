@@ -1,6 +1,8 @@
-import json
 import glob
+import mmap
+import os
 import random
+import shutil
 from pathlib import Path
 
 # Folder containing your JSONL files
@@ -10,28 +12,44 @@ input_folder = Path("filled_templates")
 combined_file = input_folder / "combined_IFT.jsonl"
 shuffled_file = input_folder / "combined_IFT_shuffled.jsonl"
 
-all_data = []
-
-# Read only JSONL files starting with "IFT"
-for jsonl_file in sorted(input_folder.glob("filled*.jsonl")):
-    with open(jsonl_file, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.strip():  # Skip empty lines
-                all_data.append(json.loads(line))
-
-# Write combined JSONL
-with open(combined_file, "w", encoding="utf-8") as f:
-    for item in all_data:
-        f.write(json.dumps(item) + "\n")
-
-# Set seed for reproducibility
-random.seed(42)
-random.shuffle(all_data)
-
-# Write shuffled JSONL
-with open(shuffled_file, "w", encoding="utf-8") as f:
-    for item in all_data:
-        f.write(json.dumps(item) + "\n")
+# Read only JSONL files starting with "filled"
+with os.scandir(input_folder) as it:
+    jsonl_files = sorted(
+        e.path for e in it
+        if e.name.startswith("filled") and e.name.endswith(".jsonl") and e.is_file()
+    )
+
+# Combine JSONL files byte-for-byte (no parse / re-serialize round trip), 1 MiB at a time
+with open(combined_file, "wb") as dst:
+    for jsonl_file in jsonl_files:
+        with open(jsonl_file, "rb") as src:
+            shutil.copyfileobj(src, dst, length=1 << 20)
+            # Make sure the next file starts on its own line
+            if src.tell():
+                src.seek(-1, os.SEEK_END)
+                if src.read(1) != b"\n":
+                    dst.write(b"\n")
+
+# Shuffle the (start, end) span of every non-empty line; the combined file is
+# memory-mapped so lines are sliced straight out of the page cache
+with open(combined_file, "rb") as f, open(shuffled_file, "wb") as dst:
+    if os.fstat(f.fileno()).st_size:  # mmap cannot map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            spans = []
+            start, size = 0, len(mm)
+            while start < size:
+                end = mm.find(b"\n", start)
+                end = size if end == -1 else end + 1
+                if mm[start:end].strip():  # Skip empty lines
+                    spans.append((start, end))
+                start = end
+
+            # Set seed for reproducibility
+            random.seed(42)
+            random.shuffle(spans)
+
+            for start, end in spans:
+                dst.write(mm[start:end])
 
 print(f"Combined JSONL saved to {combined_file}")
 print(f"Shuffled JSONL saved to {shuffled_file}")
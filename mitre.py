@@ -1,21 +1,47 @@
 import os
-import json
+import re
+import contextlib
+import functools
 import argparse
 import datetime
+import multiprocessing
+import queue
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, ContextManager, Iterable, Iterator, Optional, Tuple
 
+import orjson
+
+from parallel import chunked, map_bounded
 from query_postgre import run_query as pg_run_query
+from query_postgre import run_query_iter as pg_run_query_iter
 from query_neo4j import run_query_dict as neo4j_run_query_dict
 
 # Paths
 TEMPLATES_PATH = Path("templates/IFT_MITRE.jsonl")
 OUTPUT_DIR = Path("filled_templates")
 
+# Neo4j relationships the lookups read, as (MATCH pattern, key node, value node)
+SUBTECHNIQUES = ("(st:Technique)-[:CHILD_OF]->(t:Technique)", "t", "st")
+TOOL_TECHNIQUES = ("(t:Tool)-[:USES]->(tech:Technique)", "t", "tech")
+CAMPAIGN_TOOLS = ("(c:Campaign)-[:USES]->(t:Tool)", "c", "t")
+CAMPAIGN_TECHNIQUES = ("(c:Campaign)-[:USES]->(tech:Technique)", "c", "tech")
+MALWARE_TECHNIQUES = ("(m:Malware)-[:USES]->(tech:Technique)", "m", "tech")
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+# Technique placeholders that are only worth resolving when a template uses them
+TACTIC_PLACEHOLDERS = frozenset({"tactic_name", "tactic_purpose", "tactic_id"})
+
 # ---------------------- Helper Functions ----------------------
 
 def load_templates(path: Path) -> List[Dict[str, Any]]:
-    """Read JSONL templates file and return list of template dicts."""
+    """
+    Read JSONL templates file and return list of template dicts.
+    Each template's input and output are compiled once (see compile_template) and
+    stored as its `_render_input` / `_render_output` callables.
+    """
     if not path.exists():
         raise FileNotFoundError(f"Templates file not found: {path}")
     templates = []
@@ -23,7 +49,7 @@ def load_templates(path: Path) -> List[Dict[str, Any]]:
         for line in fh:
             line = line.strip()
             if line:
-                templates.append(json.loads(line))
+                templates.append(_with_renderers(orjson.loads(line)))
     return templates
 
 
@@ -32,10 +58,13 @@ def safe_to_list(field_value) -> List[str]:
     if not field_value:
         return []
     if isinstance(field_value, list):
+        # json/jsonb and text[] columns already arrive as lists of strings
+        if all(isinstance(x, str) for x in field_value):
+            return field_value
         return [str(x) for x in field_value]
     if isinstance(field_value, str):
         try:
-            parsed = json.loads(field_value)
+            parsed = orjson.loads(field_value)
             if isinstance(parsed, list):
                 return [str(x) for x in parsed]
         except Exception:
@@ -44,200 +73,238 @@ def safe_to_list(field_value) -> List[str]:
     return [str(field_value)]
 
 
-def fill_template_text(template_text: str, placeholders: Dict[str, str]) -> str:
-    """Replace {placeholders} in template_text with actual values."""
-    out = template_text
-    for k, v in placeholders.items():
-        out = out.replace(f"{{{k}}}", v if v is not None else "")
-    return out
+def compile_template(template_text: str) -> Callable[[Dict[str, Any]], str]:
+    """
+    Split template_text into (literal, placeholder) pieces once and return a function
+    that fills it from a placeholders dict. Unknown placeholders are left as-is and
+    None values render as empty strings.
+    """
+    parts = []
+    last = 0
+    for m in _PLACEHOLDER.finditer(template_text):
+        parts.append((template_text[last:m.start()], m.group(1)))
+        last = m.end()
+    tail = template_text[last:]
+
+    def render(placeholders: Dict[str, Any]) -> str:
+        out = []
+        for literal, key in parts:
+            out.append(literal)
+            if key in placeholders:
+                v = placeholders[key]
+                out.append(v if v is not None else "")
+            else:
+                out.append(f"{{{key}}}")
+        out.append(tail)
+        return "".join(out)
+
+    return render
+
+
+def _with_renderers(tmpl: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Attach the compiled `_render_input` / `_render_output` callables to a template dict,
+    and flag (`_uses_tactic`) whether its text references any tactic placeholder.
+    """
+    text_in, text_out = tmpl.get("input", ""), tmpl.get("output", "")
+    tmpl["_render_input"] = compile_template(text_in)
+    tmpl["_render_output"] = compile_template(text_out)
+    tmpl["_uses_tactic"] = not TACTIC_PLACEHOLDERS.isdisjoint(_PLACEHOLDER.findall(text_in + text_out))
+    return tmpl
 
 
 # ---------------------- Data Extraction ----------------------
+# The tactics table, each Neo4j relationship type and each PostgreSQL name table
+# are fetched whole, once, so the per-ID helpers are dict lookups.
+# Cached results are shared, so callers must only read them.
+
+# Prefetched lookup tables, keyed by (function name, *args); copied into the
+# worker processes, which therefore never query the databases themselves
+_LOOKUPS: Dict[Tuple[Any, ...], Any] = {}
+
+
+def _prefetched(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Cache a whole-table lookup in _LOOKUPS."""
+    @functools.wraps(func)
+    def wrapper(*args: Any) -> Any:
+        key = (func.__name__,) + args
+        if key not in _LOOKUPS:
+            _LOOKUPS[key] = func(*args)
+        return _LOOKUPS[key]
 
-def get_techniques(limit: int = None) -> List[Dict[str, Any]]:
-    """Fetch techniques from PostgreSQL."""
+    return wrapper
+
+
+def get_techniques(limit: int = None) -> Iterator[Dict[str, Any]]:
+    """Stream techniques from PostgreSQL through a server-side cursor."""
     q = "SELECT mitre_id, name, description, x_mitre_data_sources, x_mitre_platforms, kill_chain_phases FROM techniques ORDER BY mitre_id"
+    params = None
     if limit:
-        q += f" LIMIT {limit}"
-    return pg_run_query(q, return_dict=True)
+        q += " LIMIT %s"
+        params = (limit,)
+    return pg_run_query_iter(q, params, return_dict=True, name="techniques_stream", itersize=2000)
 
 
-def get_tools(limit: int = None) -> List[Dict[str, Any]]:
-    """Fetch tools from PostgreSQL."""
+def get_tools(limit: int = None) -> Iterator[Dict[str, Any]]:
+    """Stream tools from PostgreSQL through a server-side cursor."""
     q = "SELECT mitre_id, name, description FROM tools ORDER BY mitre_id"
+    params = None
     if limit:
-        q += f" LIMIT {limit}"
-    return pg_run_query(q, return_dict=True)
+        q += " LIMIT %s"
+        params = (limit,)
+    return pg_run_query_iter(q, params, return_dict=True, name="tools_stream", itersize=2000)
+
+
+@_prefetched
+def _tactics() -> Dict[str, Dict[str, Any]]:
+    """Fetch the whole (small) tactics table once, keyed by shortname."""
+    tactics: Dict[str, Dict[str, Any]] = {}
+    for shortname, mitre_id, name, description in pg_run_query("SELECT shortname, mitre_id, name, description FROM tactics;"):
+        tactics.setdefault(shortname, {"mitre_id": mitre_id, "name": name, "description": description})
+    return tactics
 
 
+@functools.lru_cache(maxsize=None)
 def get_tactic_by_shortname(shortname: str) -> Dict[str, Any]:
     """Lookup tactic details by shortname."""
     if not shortname:
         return {"mitre_id": "", "name": "", "description": ""}
 
-    safe_short = shortname.replace("'", "''")
-    q = f"SELECT mitre_id, name, description FROM tactics WHERE shortname = '{safe_short}' LIMIT 1;"
-    try:
-        res = pg_run_query(q, return_dict=True)
-    except Exception as e:
-        print(f"[get_tactic_by_shortname] query error: {e}")
-        return {"mitre_id": "", "name": shortname, "description": ""}
-
-    if res:
-        row = res[0]
-        return {
-            "mitre_id": row.get("mitre_id", ""),
-            "name": row.get("name", ""),
-            "description": row.get("description", "")
-        }
+    tactic = _tactics().get(shortname)
+    if tactic:
+        return tactic
 
     print(f"[get_tactic_by_shortname] no tactic found for shortname='{shortname}'")
     return {"mitre_id": "", "name": shortname, "description": ""}
 
 
-def get_subtechniques(technique_id: str) -> List[str]:
-    """Fetch subtechniques for a technique from Neo4j, get their names from PostgreSQL."""
+@_prefetched
+def _related_ids(pattern: str, key: str, value: str) -> Dict[str, List[str]]:
+    """
+    Fetch every match of a Neo4j relationship `pattern` in one query and group
+    the `value` node IDs by the `key` node ID (both sorted).
+    """
     query = f"""
-    MATCH (st:Technique)-[:CHILD_OF]->(t:Technique)
-    WHERE t.mitre_id = '{technique_id}'
-    RETURN st.mitre_id AS mitre_id
-    ORDER BY st.mitre_id
+    MATCH {pattern}
+    RETURN {key}.mitre_id AS key_id, {value}.mitre_id AS value_id
+    ORDER BY {key}.mitre_id, {value}.mitre_id
     """
-    subtechs = neo4j_run_query_dict(query, keys=["mitre_id"])
+    grouped: Dict[str, List[str]] = {}
+    for r in neo4j_run_query_dict(query, keys=["key_id", "value_id"]):
+        if r.get("key_id") and r.get("value_id"):
+            grouped.setdefault(r["key_id"], []).append(r["value_id"])
+    return grouped
 
-    if not subtechs:
-        return ["None"]
 
-    subtech_ids = [st["mitre_id"] for st in subtechs if st.get("mitre_id")]
-    if not subtech_ids:
-        return ["None"]
+@_prefetched
+def _names(table: str) -> Dict[str, Any]:
+    """Fetch mitre_id -> name for every row of a PostgreSQL table in one query."""
+    return dict(pg_run_query(f"SELECT mitre_id, name FROM {table};"))
 
-    ids_str = ", ".join([f"'{sid}'" for sid in subtech_ids])
-    q = f"SELECT mitre_id, name FROM techniques WHERE mitre_id IN ({ids_str});"
-    res = pg_run_query(q, return_dict=True)
 
-    if not res:
+def prefetch_lookups(max_workers: int = 8) -> None:
+    """Fill the relationship, name and tactic caches, running the Neo4j and PostgreSQL queries concurrently."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_related_ids, *rel)
+            for rel in (SUBTECHNIQUES, TOOL_TECHNIQUES, CAMPAIGN_TOOLS, CAMPAIGN_TECHNIQUES, MALWARE_TECHNIQUES)
+        ]
+        futures += [executor.submit(_names, table) for table in ("techniques", "tools")]
+        futures.append(executor.submit(_tactics))
+        for future in futures:
+            future.result()
+
+
+def _named(ids: List[str], names: Dict[str, Any]) -> List[str]:
+    """Format IDs as "name (id)"; IDs unknown to PostgreSQL are dropped, or returned bare if none is known."""
+    known = [i for i in ids if i in names]
+    if not known:
+        return list(ids)
+    return [f"{names[i]} ({i})" for i in known if names[i]]
+
+
+def get_subtechniques(technique_id: str) -> List[str]:
+    """Fetch subtechniques for a technique from Neo4j, get their names from PostgreSQL."""
+    subtech_ids = _related_ids(*SUBTECHNIQUES).get(technique_id)
+    if not subtech_ids:
         return ["None"]
 
-    return [f"{r['name']} ({r['mitre_id']})" for r in res]
+    names = _names("techniques")
+    return [f"{names[sid]} ({sid})" for sid in subtech_ids if sid in names] or ["None"]
 
 
 def get_techniques_by_tool(tool_id: str) -> List[str]:
     """Fetch technique names for a tool using Neo4j + PostgreSQL."""
-    query = f"""
-    MATCH (t:Tool)-[:USES]->(tech:Technique)
-    WHERE t.mitre_id = '{tool_id}'
-    RETURN tech.mitre_id AS mitre_id
-    ORDER BY tech.mitre_id
-    """
-    techs = neo4j_run_query_dict(query, keys=["mitre_id"])
-
-    if not techs:
-        return ["None techniques"]
-
-    technique_ids = [t["mitre_id"] for t in techs if t.get("mitre_id")]
+    technique_ids = _related_ids(*TOOL_TECHNIQUES).get(tool_id)
     if not technique_ids:
         return ["None techniques"]
+    return _named(technique_ids, _names("techniques"))
 
-    ids_str = ", ".join([f"'{tid}'" for tid in technique_ids])
-    q = f"SELECT mitre_id, name FROM techniques WHERE mitre_id IN ({ids_str});"
-    res = pg_run_query(q, return_dict=True)
-
-    if not res:
-        return [tid for tid in technique_ids]
-
-    return [f"{r['name']} ({r['mitre_id']})" for r in res if r.get("name")]
-
-def get_campaigns(limit: int = None) -> List[Dict[str, Any]]:
-    """Fetch campaigns from PostgreSQL."""
+def get_campaigns(limit: int = None) -> Iterator[Dict[str, Any]]:
+    """Stream campaigns from PostgreSQL through a server-side cursor."""
     q = "SELECT mitre_id, name, description FROM campaigns ORDER BY mitre_id"
+    params = None
     if limit:
-        q += f" LIMIT {limit}"
-    return pg_run_query(q, return_dict=True)
+        q += " LIMIT %s"
+        params = (limit,)
+    return pg_run_query_iter(q, params, return_dict=True, name="campaigns_stream", itersize=2000)
 
 
 def get_tools_by_campaign(campaign_id: str) -> List[str]:
     """Fetch tools linked to a campaign from Neo4j, get names from PostgreSQL."""
-    query = f"""
-    MATCH (c:Campaign)-[:USES]->(t:Tool)
-    WHERE c.mitre_id = '{campaign_id}'
-    RETURN t.mitre_id AS mitre_id
-    ORDER BY t.mitre_id
-    """
-    tools = neo4j_run_query_dict(query, keys=["mitre_id"])
-
-    if not tools:
-        return ["None"]
-
-    tool_ids = [t["mitre_id"] for t in tools if t.get("mitre_id")]
+    tool_ids = _related_ids(*CAMPAIGN_TOOLS).get(campaign_id)
     if not tool_ids:
         return ["None"]
-
-    ids_str = ", ".join([f"'{tid}'" for tid in tool_ids])
-    q = f"SELECT mitre_id, name FROM tools WHERE mitre_id IN ({ids_str});"
-    res = pg_run_query(q, return_dict=True)
-
-    if not res:
-        return [tid for tid in tool_ids]
-
-    return [f"{r['name']} ({r['mitre_id']})" for r in res if r.get("name")]
+    return _named(tool_ids, _names("tools"))
 
 
 def get_techniques_by_campaign(campaign_id: str) -> List[str]:
     """Fetch techniques linked to a campaign from Neo4j, get names from PostgreSQL."""
-    query = f"""
-    MATCH (c:Campaign)-[:USES]->(tech:Technique)
-    WHERE c.mitre_id = '{campaign_id}'
-    RETURN tech.mitre_id AS mitre_id
-    ORDER BY tech.mitre_id
-    """
-    techs = neo4j_run_query_dict(query, keys=["mitre_id"])
-
-    if not techs:
-        return ["None techniques"]
-
-    technique_ids = [t["mitre_id"] for t in techs if t.get("mitre_id")]
+    technique_ids = _related_ids(*CAMPAIGN_TECHNIQUES).get(campaign_id)
     if not technique_ids:
         return ["None techniques"]
+    return _named(technique_ids, _names("techniques"))
 
-    ids_str = ", ".join([f"'{tid}'" for tid in technique_ids])
-    q = f"SELECT mitre_id, name FROM techniques WHERE mitre_id IN ({ids_str});"
-    res = pg_run_query(q, return_dict=True)
-
-    if not res:
-        return [tid for tid in technique_ids]
-
-    return [f"{r['name']} ({r['mitre_id']})" for r in res if r.get("name")]
-
-def get_malware(limit: int = None) -> List[Dict[str, Any]]:
-    """Fetch malware entries from PostgreSQL."""
+def get_malware(limit: int = None) -> Iterator[Dict[str, Any]]:
+    """Stream malware entries from PostgreSQL through a server-side cursor."""
     q = "SELECT mitre_id, name, description FROM malware ORDER BY mitre_id"
+    params = None
     if limit:
-        q += f" LIMIT {limit}"
-    return pg_run_query(q, return_dict=True)
+        q += " LIMIT %s"
+        params = (limit,)
+    return pg_run_query_iter(q, params, return_dict=True, name="malware_stream", itersize=2000)
 
 
 def get_techniques_by_malware(malware_id: str) -> List[str]:
     """Fetch technique IDs linked to malware from Neo4j."""
-    query = f"""
-    MATCH (m:Malware)-[:USES]->(tech:Technique)
-    WHERE m.mitre_id = '{malware_id}'
-    RETURN tech.mitre_id AS mitre_id
-    ORDER BY tech.mitre_id
-    """
-    techs = neo4j_run_query_dict(query, keys=["mitre_id"])
+    technique_ids = _related_ids(*MALWARE_TECHNIQUES).get(malware_id)
+    return technique_ids or ["None techniques"]
 
-    if not techs:
-        return ["None techniques"]
 
-    technique_ids = [t["mitre_id"] for t in techs if t.get("mitre_id")]
-    return technique_ids if technique_ids else ["None"]
+# ---------------------- Template Filling ----------------------
 
+# A template belongs to an entity kind when its input contains one of these placeholders
+TEMPLATE_KIND_TAGS = {
+    "technique": ("{technique_id}", "{technique_name}", "{brief_description_of_technique}"),
+    "tool": ("{tool_id}",),
+    "campaign": ("{campaign_id}",),
+    "malware": ("{malware_id}",),
+}
 
-# ---------------------- Template Filling ----------------------
 
-def build_filled_entries_techniques(templates: List[Dict[str, Any]], techniques: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Fill technique-related templates."""
+def partition_templates(templates: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Split templates by entity kind once, so the builders never scan template text per entity."""
+    return {
+        kind: [tmpl for tmpl in templates if any(tag in tmpl.get("input", "") for tag in tags)]
+        for kind, tags in TEMPLATE_KIND_TAGS.items()
+    }
+
+
+def build_filled_entries_techniques(templates: List[Dict[str, Any]], techniques: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fill technique-related templates (templates from partition_templates()["technique"])."""
+    # The tactic flags are set once per template by _with_renderers; when no template
+    # mentions the tactic, the kill chain parsing and tactic lookup are skipped outright
+    uses_tactic = any(tmpl["_uses_tactic"] for tmpl in templates)
     filled = []
     for t in techniques:
         mitre_id = t.get("mitre_id", "")
@@ -256,38 +323,39 @@ def build_filled_entries_techniques(templates: List[Dict[str, Any]], techniques:
         }
 
         # Handle one tactic only (first phase if exists)
-        phases_raw = t.get("kill_chain_phases") or []
-        try:
-            phases = json.loads(phases_raw) if isinstance(phases_raw, str) else phases_raw
-        except Exception:
-            phases = [{"phase_name": p.strip()} for p in str(phases_raw).split(",") if p.strip()]
-
-        if phases:
-            ph = phases[0]
-            phase_name = ph.get("phase_name") if isinstance(ph, dict) else str(ph)
-            tactic = get_tactic_by_shortname(phase_name)
-            placeholders.update({
-                "tactic_name": tactic.get("name", ""),
-                "tactic_purpose": tactic.get("description", ""),
-                "tactic_id": tactic.get("mitre_id", "")
-            })
-        else:
-            placeholders.update({"tactic_name": "", "tactic_purpose": "", "tactic_id": ""})
-
-        for tmpl in templates:  # Only first 6 technique templates
-            if not any(tag in tmpl.get("input", "") for tag in ["{technique_id}", "{technique_name}", "{brief_description_of_technique}"]):
-                continue
+        if uses_tactic:
+            phases_raw = t.get("kill_chain_phases") or []
+            if isinstance(phases_raw, list):
+                phases = phases_raw  # json/jsonb column, already decoded by the driver
+            else:
+                try:
+                    phases = orjson.loads(phases_raw) if isinstance(phases_raw, str) else phases_raw
+                except orjson.JSONDecodeError:
+                    phases = [{"phase_name": p.strip()} for p in str(phases_raw).split(",") if p.strip()]
+
+            if phases:
+                ph = phases[0]
+                phase_name = ph.get("phase_name") if isinstance(ph, dict) else str(ph)
+                tactic = get_tactic_by_shortname(phase_name)
+                placeholders.update({
+                    "tactic_name": tactic.get("name", ""),
+                    "tactic_purpose": tactic.get("description", ""),
+                    "tactic_id": tactic.get("mitre_id", "")
+                })
+            else:
+                placeholders.update({"tactic_name": "", "tactic_purpose": "", "tactic_id": ""})
 
+        for tmpl in templates:
             filled.append({
                 "instruction": tmpl["instruction"],
-                "input": fill_template_text(tmpl["input"], placeholders),
-                "output": fill_template_text(tmpl["output"], placeholders)
+                "input": tmpl["_render_input"](placeholders),
+                "output": tmpl["_render_output"](placeholders)
             })
 
     return filled
 
-def build_filled_entries_tools(templates: List[Dict[str, Any]], tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Fill tool-related templates."""
+def build_filled_entries_tools(templates: List[Dict[str, Any]], tools: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fill tool-related templates (templates from partition_templates()["tool"])."""
     filled = []
     for tool in tools:
         tool_id = tool.get("mitre_id", "")
@@ -304,19 +372,16 @@ def build_filled_entries_tools(templates: List[Dict[str, Any]], tools: List[Dict
         }
 
         for tmpl in templates:
-            if "{tool_id}" not in tmpl.get("input", ""):
-                continue  # skip non-tool templates
-
             filled.append({
                 "instruction": tmpl["instruction"],
-                "input": fill_template_text(tmpl["input"], placeholders),
-                "output": fill_template_text(tmpl["output"], placeholders)
+                "input": tmpl["_render_input"](placeholders),
+                "output": tmpl["_render_output"](placeholders)
             })
 
     return filled
 
-def build_filled_entries_campaigns(templates: List[Dict[str, Any]], campaigns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Fill campaign-related templates (templates 9 and 10)."""
+def build_filled_entries_campaigns(templates: List[Dict[str, Any]], campaigns: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fill campaign-related templates (templates from partition_templates()["campaign"])."""
     filled = []
     for camp in campaigns:
         camp_id = camp.get("mitre_id", "")
@@ -335,19 +400,16 @@ def build_filled_entries_campaigns(templates: List[Dict[str, Any]], campaigns: L
         }
 
         for tmpl in templates:
-            if "{campaign_id}" not in tmpl.get("input", ""):
-                continue  # skip non-campaign templates
-
             filled.append({
                 "instruction": tmpl["instruction"],
-                "input": fill_template_text(tmpl["input"], placeholders),
-                "output": fill_template_text(tmpl["output"], placeholders)
+                "input": tmpl["_render_input"](placeholders),
+                "output": tmpl["_render_output"](placeholders)
             })
 
     return filled
 
-def build_filled_entries_malware(templates: List[Dict[str, Any]], malware_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """Fill malware-related templates."""
+def build_filled_entries_malware(templates: List[Dict[str, Any]], malware_list: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fill malware-related templates (templates from partition_templates()["malware"])."""
     filled = []
     for mw in malware_list:
         mw_id = mw.get("mitre_id", "")
@@ -364,68 +426,200 @@ def build_filled_entries_malware(templates: List[Dict[str, Any]], malware_list:
         }
 
         for tmpl in templates:
-            if "{malware_id}" not in tmpl.get("input", ""):
-                continue  # skip non-malware templates
-
             filled.append({
                 "instruction": tmpl["instruction"],
-                "input": fill_template_text(tmpl["input"], placeholders),
-                "output": fill_template_text(tmpl["output"], placeholders)
+                "input": tmpl["_render_input"](placeholders),
+                "output": tmpl["_render_output"](placeholders)
             })
 
     return filled
 
+# ---------------------- Parallel Filling ----------------------
+
+# Entities handed to a worker process at a time
+CHUNK_SIZE = 64
+
+# Filled batches (one per chunk) waiting for the writer thread, the output buffer
+# size it writes in, and how often a blocked producer checks the writer is alive
+WRITE_QUEUE_BATCHES = 32
+FLUSH_BYTES = 1 << 20
+WRITER_POLL_SECONDS = 0.5
+
+# How worker processes are started; never plain fork, since the writer thread is running
+WORKER_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Entity kinds in output order, with the getter that streams their rows
+ENTITY_SOURCES = (
+    ("technique", get_techniques),
+    ("tool", get_tools),
+    ("campaign", get_campaigns),
+    ("malware", get_malware),
+)
+
+ENTITY_BUILDERS = {
+    "technique": build_filled_entries_techniques,
+    "tool": build_filled_entries_tools,
+    "campaign": build_filled_entries_campaigns,
+    "malware": build_filled_entries_malware,
+}
+
+# Templates for the current worker process (set by _init_worker)
+_WORKER_TEMPLATES: Dict[str, List[Dict[str, Any]]] = {}
+
+
+def _without_renderers(templates_by_kind: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Copy the templates without their compiled renderers, which cannot be pickled."""
+    return {
+        kind: [{k: v for k, v in tmpl.items() if not k.startswith("_render")} for tmpl in templates]
+        for kind, templates in templates_by_kind.items()
+    }
+
+
+def _init_worker(templates_by_kind: Dict[str, List[Dict[str, Any]]], lookups: Dict[Tuple[Any, ...], Any]) -> None:
+    """Compile the templates and install the prefetched lookups once per worker process."""
+    global _WORKER_TEMPLATES
+    _LOOKUPS.update(lookups)
+    _WORKER_TEMPLATES = {
+        kind: [_with_renderers(tmpl) for tmpl in templates]
+        for kind, templates in templates_by_kind.items()
+    }
+
+
+def _fill_chunk(kind: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fill the worker's `kind` templates for a chunk of entity rows."""
+    return ENTITY_BUILDERS[kind](_WORKER_TEMPLATES[kind], rows)
+
+
+def fill_entities(kind: str, templates_by_kind: Dict[str, List[Dict[str, Any]]], rows: Iterable[Dict[str, Any]],
+                  executor: Optional[ProcessPoolExecutor] = None, max_pending: int = 2) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Fill the `kind` templates for every entity row, yielding one batch of entries per
+    chunk of rows. With an executor, chunks are filled in worker processes with at most
+    `max_pending` in flight, so the row stream is never drained up front; batches keep
+    the row order either way.
+    """
+    chunks = chunked(rows, CHUNK_SIZE)
+    if executor is None:
+        build = ENTITY_BUILDERS[kind]
+        templates = templates_by_kind[kind]
+        for chunk in chunks:
+            yield build(templates, chunk)
+        return
+
+    yield from map_bounded(executor, functools.partial(_fill_chunk, kind), chunks, max_pending)
+
+
+def _write_entries(outpath: Path, batches: "queue.Queue[Optional[List[Dict[str, Any]]]]") -> None:
+    """
+    Writer thread: serialize batches of filled entries to outpath until a None
+    sentinel arrives. The file is only created once the first entry shows up.
+    """
+    fh = None
+    buf = bytearray()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            for entry in batch:
+                buf += orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE)
+            if len(buf) > FLUSH_BYTES:
+                if fh is None:
+                    fh = outpath.open("wb")
+                fh.write(buf)
+                buf.clear()
+        if buf:
+            if fh is None:
+                fh = outpath.open("wb")
+            fh.write(buf)
+    finally:
+        if fh is not None:
+            fh.close()
+
+
+def _send_to_writer(batches: "queue.Queue[Optional[List[Dict[str, Any]]]]",
+                    item: Optional[List[Dict[str, Any]]], writer: "Future[None]") -> bool:
+    """
+    Queue a batch (or the None sentinel) for the writer. Returns False instead of
+    blocking forever on a full queue once the writer has stopped.
+    """
+    while not writer.done():
+        try:
+            batches.put(item, timeout=WRITER_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
 # ---------------------- Main ----------------------
 
+def _non_empty(rows: Iterator[Dict[str, Any]]) -> Optional[Iterator[Dict[str, Any]]]:
+    """Return the row stream unchanged, or None when it yields nothing."""
+    first = next(rows, None)
+    return None if first is None else chain([first], rows)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Fill MITRE templates using helpers.")
     parser.add_argument("--limit", type=int, default=None, help="Limit number of items")
     parser.add_argument("--templates", type=str, default=str(TEMPLATES_PATH))
     parser.add_argument("--outdir", type=str, default=str(OUTPUT_DIR))
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count, 1 disables the pool)")
     args = parser.parse_args()
 
     outdir = Path(args.outdir)
     outdir.mkdir(parents=True, exist_ok=True)
 
-    templates = load_templates(Path(args.templates))
-
-    filled_all = []
-
-    # ---- Techniques ----
-    techniques = get_techniques(limit=args.limit)
-    if techniques:
-        filled_techniques = build_filled_entries_techniques(templates, techniques)
-        filled_all.extend(filled_techniques)
-        print(f"✅ Built {len(filled_techniques)} technique entries")
-
-    # ---- Tools ----
-    tools = get_tools(limit=args.limit)
-    if tools:
-        filled_tools = build_filled_entries_tools(templates, tools)
-        filled_all.extend(filled_tools)
-        print(f"✅ Built {len(filled_tools)} tool entries")
-
-    # ---- Campaigns ----
-    campaigns = get_campaigns(limit=args.limit)
-    if campaigns:
-        filled_campaigns = build_filled_entries_campaigns(templates, campaigns)
-        filled_all.extend(filled_campaigns)
-        print(f"✅ Built {len(filled_campaigns)} campaign entries")
-    
-    # ---- Malware ----
-    malware_list = get_malware(limit=args.limit)
-    if malware_list:
-        filled_malware = build_filled_entries_malware(templates, malware_list)
-        filled_all.extend(filled_malware)
-        print(f"✅ Built {len(filled_malware)} malware entries")
+    templates_by_kind = partition_templates(load_templates(Path(args.templates)))
+
+    # Relationship and name lookups are independent round-trips; overlap them up front
+    prefetch_lookups()
+
+    # Workers receive the templates and every prefetched lookup when they start,
+    # so all database access stays in this process. They are started from a fork
+    # server rather than forked from here, where the writer thread is already running
+    # and a lock it holds at fork time could deadlock the child.
+    workers = args.workers or os.cpu_count() or 1
+    pool: ContextManager[Optional[ProcessPoolExecutor]]
+    if workers > 1:
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(_without_renderers(templates_by_kind), dict(_LOOKUPS)),
+            mp_context=multiprocessing.get_context(WORKER_START_METHOD),
+        )
+    else:
+        pool = contextlib.nullcontext()
+
+    # Entries stream through a bounded queue to a writer thread, so serialization and
+    # disk writes overlap with filling and only a few batches are held in memory
+    outpath = outdir / f"filled_mitre_templates_{args.limit or 'all'}.jsonl"
+    batches: "queue.Queue[Optional[List[Dict[str, Any]]]]" = queue.Queue(maxsize=WRITE_QUEUE_BATCHES)
+    total = 0
+    with ThreadPoolExecutor(max_workers=1) as writer_pool:
+        writer = writer_pool.submit(_write_entries, outpath, batches)
+        try:
+            with pool as executor:
+                for kind, get_rows in ENTITY_SOURCES:
+                    rows = _non_empty(get_rows(limit=args.limit))
+                    if not rows:
+                        continue
+                    count = 0
+                    for batch in fill_entities(kind, templates_by_kind, rows, executor, 2 * workers):
+                        if not _send_to_writer(batches, batch, writer):
+                            writer.result()  # the writer only stops early by raising
+                        count += len(batch)
+                    total += count
+                    print(f"✅ Built {count} {kind} entries")
+        finally:
+            _send_to_writer(batches, None, writer)
+        # Surface a failed write instead of reporting success
+        writer.result()
 
     # ---- Single Combined Output ----
-    if filled_all:
-        outpath = outdir / f"filled_mitre_templates_{args.limit or 'all'}.jsonl"
-        with outpath.open("w", encoding="utf-8") as fh:
-            for entry in filled_all:
-                fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
-        print(f"🎯 Combined {len(filled_all)} total entries → {outpath}")
+    if total:
+        print(f"🎯 Combined {total} total entries → {outpath}")
     else:
         print("⚠️ No entries were generated.")
 
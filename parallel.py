@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the template fillers to fan row chunks out to worker processes.
+"""
+
+from collections import deque
+from concurrent.futures import Executor, Future
+from itertools import islice
+from typing import Callable, Deque, Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def chunked(rows: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Group an iterable of rows into lists of at most `size` rows."""
+    it = iter(rows)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def map_bounded(executor: Executor, fn: Callable[[T], R], items: Iterable[T], max_pending: int) -> Iterator[R]:
+    """
+    Like executor.map, but submits lazily: at most `max_pending` items are in flight,
+    so a streamed input is never drained up front. Results keep the input order.
+    """
+    pending: Deque["Future[R]"] = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
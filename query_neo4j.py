@@ -4,15 +4,28 @@ Neo4j helper module to run Cypher queries and return results.
 """
 
 import os
+import threading
+from typing import Any, Optional
 import requests
 import base64
 
+GraphDatabase: Optional[Any]
+try:
+    from neo4j import GraphDatabase
+except ImportError:  # Bolt is optional; HTTP is used unless NEO4J_BOLT_URL is set
+    GraphDatabase = None
+
 # Neo4j configuration from environment variables (can be overridden)
 NEO4J_URL = os.getenv('NEO4J_URL', 'http://127.0.0.1:7474')
 NEO4J_USER = os.getenv('NEO4J_USER', 'neo4j')
 NEO4J_PASSWORD = os.getenv('NEO4J_PASSWORD', 'yx1c8dp3FSk3vEU375T0zeVz9fQryJZX')
+NEO4J_DATABASE = os.getenv('NEO4J_DATABASE', 'neo4j')
+
+NEO4J_ENDPOINT = f"{NEO4J_URL}/db/{NEO4J_DATABASE}/tx/commit"
 
-NEO4J_ENDPOINT = f"{NEO4J_URL}/db/neo4j/tx/commit"
+# Bolt (binary protocol, pooled connections) replaces HTTP when set, e.g. bolt://127.0.0.1:7687
+NEO4J_BOLT_URL = os.getenv('NEO4J_BOLT_URL')
+NEO4J_POOL_SIZE = int(os.getenv('NEO4J_POOL_SIZE', 32))
 
 # Create base64 encoded auth header
 auth_string = f"{NEO4J_USER}:{NEO4J_PASSWORD}"
@@ -24,15 +37,51 @@ HEADERS = {
     "Authorization": f"Basic {auth_b64}"
 }
 
+# A single session keeps the HTTP connection alive across queries
+_SESSION = requests.Session()
+_SESSION.headers.update(HEADERS)
+
+_DRIVER = None
+_DRIVER_LOCK = threading.Lock()
+
 
-def run_query(query):
+def _get_driver():
+    """Create the shared Bolt driver (which pools its own connections) on first use (safe to call from several threads)."""
+    global _DRIVER
+    driver = _DRIVER
+    if driver is None:
+        with _DRIVER_LOCK:
+            if _DRIVER is None:
+                if GraphDatabase is None:
+                    raise ImportError("NEO4J_BOLT_URL is set but the neo4j driver is not installed")
+                assert NEO4J_BOLT_URL is not None
+                _DRIVER = GraphDatabase.driver(
+                    NEO4J_BOLT_URL,
+                    auth=(NEO4J_USER, NEO4J_PASSWORD),
+                    max_connection_pool_size=NEO4J_POOL_SIZE,
+                    connection_acquisition_timeout=60,
+                )
+            driver = _DRIVER
+    return driver
+
+
+def run_query(query, params=None):
     """
     Run a Cypher query and return results as a list of rows.
     Each row is a list of values corresponding to the RETURN clause.
+    Optional `params` are sent as Cypher parameters (referenced as $name in the query).
+    Queries go over Bolt when NEO4J_BOLT_URL is set, otherwise over the HTTP API.
     """
     try:
-        payload = {'statements': [{'statement': query}]}
-        response = requests.post(NEO4J_ENDPOINT, headers=HEADERS, json=payload, timeout=60)
+        if NEO4J_BOLT_URL:
+            with _get_driver().session(database=NEO4J_DATABASE) as session:
+                return [list(record.values()) for record in session.run(query, params or {})]
+
+        statement = {'statement': query}
+        if params:
+            statement['parameters'] = params
+        payload = {'statements': [statement]}
+        response = _SESSION.post(NEO4J_ENDPOINT, json=payload, timeout=60)
         response.raise_for_status()
         result = response.json()
 
@@ -51,12 +100,13 @@ def run_query(query):
         return []
 
 
-def run_query_dict(query, keys=None):
+def run_query_dict(query, keys=None, params=None):
     """
     Run a Cypher query and return results as a list of dictionaries.
     Optional `keys` argument defines dictionary keys corresponding to RETURN columns.
+    Optional `params` are passed through to run_query as Cypher parameters.
     """
-    rows = run_query(query)
+    rows = run_query(query, params)
     if not rows:
         return []
 
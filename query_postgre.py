@@ -4,8 +4,13 @@ PostgreSQL helper module to run SQL queries and return results.
 """
 
 import os
+import tempfile
+import threading
+from contextlib import contextmanager
+import orjson
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 
 # Database configuration from environment variables
 DB_CONFIG = {
@@ -16,38 +21,156 @@ DB_CONFIG = {
     'port': int(os.getenv('POSTGRES_PORT', 5432))
 }
 
+# Decode json/jsonb columns with orjson so rows arrive as Python lists/dicts
+psycopg2.extras.register_default_json(globally=True, loads=orjson.loads)
+psycopg2.extras.register_default_jsonb(globally=True, loads=orjson.loads)
 
-def run_query(query, return_dict=False):
+# Connections are pooled and reused by every query in the process
+POOL_MIN_CONN = 1
+POOL_MAX_CONN = int(os.getenv('POSTGRES_POOL_SIZE', 8))
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def _get_pool():
+    """Create the shared connection pool on first use (safe to call from several threads)."""
+    global _POOL
+    pool = _POOL
+    if pool is None or pool.closed:
+        with _POOL_LOCK:
+            if _POOL is None or _POOL.closed:
+                _POOL = psycopg2.pool.ThreadedConnectionPool(POOL_MIN_CONN, POOL_MAX_CONN, **DB_CONFIG)
+            pool = _POOL
+    return pool
+
+
+@contextmanager
+def get_connection():
+    """
+    Borrow a connection from the pool for the duration of a `with` block.
+    The transaction is committed (or rolled back on error) and the connection
+    is returned to the pool instead of being closed. A connection the error
+    actually severed is dropped from the pool; statement timeouts, deadlocks
+    and serialization failures leave it usable, so it is kept.
+    """
+    pool = _get_pool()
+    conn = pool.getconn()
+    try:
+        with conn:
+            yield conn
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+def run_query(query, return_dict=False, params=None):
     """
     Run a SQL query and return results.
     
     Args:
-        query (str): The SQL query to execute.
+        query (str): The SQL query to execute, with %s placeholders for params.
         return_dict (bool): If True, return rows as list of dictionaries (column_name: value).
                             If False, return rows as list of tuples.
+        params (tuple | None): Values bound to the query placeholders.
                             
     Returns:
         list: Query results.
     """
+    # RealDictCursor builds dict rows in the driver, so no per-row conversion is needed
+    cursor_factory = psycopg2.extras.RealDictCursor if return_dict else None
+    is_select = query.strip().upper().startswith('SELECT')
+    for attempt in range(2):
+        try:
+            with get_connection() as conn, conn.cursor(cursor_factory=cursor_factory) as cursor:
+                cursor.execute(query, params)
+                
+                if is_select:
+                    return cursor.fetchall()
+                else:
+                    return {'rows_affected': cursor.rowcount}
+        except psycopg2.extensions.QueryCanceledError as e:
+            # A statement timeout would only time out again
+            print(f"Error executing query: {e}")
+            return []
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # A pooled connection may have been dropped by the server; retry a SELECT
+            # once on a fresh one. Other statements may already have been committed.
+            if attempt == 0 and is_select:
+                continue
+            print(f"Error executing query: {e}")
+            return []
+        except Exception as e:
+            print(f"Error executing query: {e}")
+            return []  # Return empty list on error
+
+
+def run_query_iter(query, params=None, return_dict=False, name="stream", itersize=500):
+    """
+    Run a SELECT through a server-side (named) cursor and yield rows one by one.
+
+    Rows are fetched from the server in batches of `itersize`, so peak memory
+    stays bounded regardless of how many rows the query returns.
+
+    Args:
+        query (str): The SELECT query to execute, with %s placeholders for params.
+        params (tuple | None): Values bound to the query placeholders.
+        return_dict (bool): If True, yield rows as dictionaries instead of tuples.
+        name (str): Name of the server-side cursor.
+        itersize (int): Number of rows fetched per network round-trip.
+
+    Yields:
+        tuple | dict: One result row at a time.
+    """
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        # Use DictCursor if return_dict=True
-        cursor_factory = psycopg2.extras.DictCursor if return_dict else None
-        with conn.cursor(cursor_factory=cursor_factory) as cursor:
-            cursor.execute(query)
-            
-            if query.strip().upper().startswith('SELECT'):
-                results = cursor.fetchall()
-                if return_dict:
-                    # Convert DictRows to normal dicts
-                    results = [dict(row) for row in results]
-                return results
-            else:
-                conn.commit()
-                return {'rows_affected': cursor.rowcount}
+        cursor_factory = psycopg2.extras.RealDictCursor if return_dict else None
+        with get_connection() as conn, conn.cursor(name=name, cursor_factory=cursor_factory) as cursor:
+            cursor.itersize = itersize
+            # DECLARE ... CURSOR FOR <query> rejects a trailing semicolon
+            cursor.execute(query.rstrip().rstrip(";"), params)
+            yield from cursor
     except Exception as e:
         print(f"Error executing query: {e}")
-        return []  # Return empty list on error
-    finally:
-        if conn:
-            conn.close()
+
+
+def run_copy_json(query, params=None, spool_size=8 << 20):
+    """
+    Export a SELECT with COPY ... TO STDOUT, one JSON object per row, and yield dicts.
+
+    Each row is aggregated server-side with to_jsonb, so the client skips
+    per-column type adaptation and receives a single stream. The stream is
+    spooled to a temporary file once it grows past `spool_size` bytes.
+
+    Args:
+        query (str): The SELECT query to export, with %s placeholders for params.
+        params (tuple | None): Values bound to the query placeholders.
+        spool_size (int): Bytes kept in memory before spilling to disk.
+
+    Yields:
+        dict: One result row at a time, keyed by column name.
+    """
+    # A quote/delimiter pair that never appears in JSON text stops COPY from
+    # escaping backslashes or quoting the row. jsonb text output escapes every
+    # newline (row_to_json would copy json columns verbatim), so each row is one line.
+    copy_sql = (
+        "COPY (SELECT to_jsonb(_row) FROM ({}) _row) "
+        "TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+    )
+    with tempfile.SpooledTemporaryFile(max_size=spool_size) as buf:
+        try:
+            with get_connection() as conn, conn.cursor() as cursor:
+                # COPY takes no bind parameters, so they are bound client-side
+                select = cursor.mogrify(query.rstrip().rstrip(";"), params).decode()
+                cursor.copy_expert(copy_sql.format(select), buf)
+        except Exception as e:
+            print(f"Error executing query: {e}")
+            return
+
+        buf.seek(0)
+        for line in buf:
+            if not line.strip():
+                continue
+            try:
+                row = orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                print(f"Error decoding row: {e}")
+                continue
+            yield row
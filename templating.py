@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the template fillers to render template text.
+"""
+
+
+class SafeDict(dict):
+    """str.format_map context in which a placeholder without a value renders as an empty string."""
+    def __missing__(self, key: str) -> str:
+        return ""